@@ -0,0 +1,141 @@
+import json
+import logging
+import time
+from typing import Iterator, Optional, TextIO, Union
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+
+class CaptureRecord:
+    """
+    A single request handled by the datastore, as stored in a capture file.
+
+    Records are stored one per line as a compact json array:
+
+    [offset, method, path, client, request_etag, response_etag, status, duration, body]
+
+    offset is the number of seconds since the capture started and duration
+    is the number of seconds the server took to handle the request.
+    body is the json argument of a PATCH or the paths argument of a GET.
+    """
+    __slots__ = (
+        "offset", "method", "path", "client", "request_etag",
+        "response_etag", "status", "duration", "body"
+    )
+
+    def __init__(
+        self,
+        offset: float,
+        method: str,
+        path: str,
+        client: Optional[Union[int, str]]=None,
+        request_etag: Optional[str]=None,
+        response_etag: Optional[str]=None,
+        status: int=200,
+        duration: float=0.0,
+        body: Optional[str]=None
+    ) -> None:
+        self.offset = offset
+        self.method = method
+        self.path = path
+        self.client = client
+        self.request_etag = request_etag
+        self.response_etag = response_etag
+        self.status = status
+        self.duration = duration
+        self.body = body
+
+    def to_line(self) -> str:
+        """
+        Serialises the record as a single line of compact json.
+        """
+        return json.dumps([
+            round(self.offset, 6), self.method, self.path, self.client,
+            self.request_etag, self.response_etag, self.status,
+            round(self.duration, 6), self.body
+        ], separators=(",", ":"))
+
+    @classmethod
+    def from_line(cls, line: str) -> "CaptureRecord":
+        """
+        Parses a record from a line written by to_line.
+        """
+        return cls(*json.loads(line))
+
+
+class TrafficCapture:
+    """
+    Records requests handled by the datastore to an append-only file.
+
+    Records are buffered in memory and only serialised when they are
+    written out in batches, so capturing adds as little as possible to
+    the time taken to handle each request.
+    """
+    def __init__(self, path: str, buffer_size: int=256) -> None:
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer: list[CaptureRecord] = []
+        self._file: Optional[TextIO] = open(path, "a")
+        self._start: float = time.monotonic()
+        logger.info(f"Capturing datastore traffic to {path}")
+
+    def record(
+        self,
+        method: str,
+        path: str,
+        client: Optional[Union[int, str]],
+        request_etag: Optional[str],
+        response_etag: Optional[str],
+        status: int,
+        duration: float,
+        body: Optional[str]=None
+    ) -> None:
+        """
+        Adds a handled request to the capture. duration is the
+        time in seconds taken to handle the request.
+        """
+        if self._file is None:
+            return
+
+        offset = time.monotonic() - duration - self._start
+        self._buffer.append(CaptureRecord(
+            offset, method, path, client, request_etag,
+            response_etag, status, duration, body
+        ))
+
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes any buffered records to the capture file.
+        """
+        if self._file is None or not self._buffer:
+            return
+
+        self._file.write("".join(f"{r.to_line()}\n" for r in self._buffer))
+        self._file.flush()
+        self._buffer.clear()
+
+    def close(self) -> None:
+        """
+        Flushes remaining records and closes the capture file.
+        """
+        if self._file is None:
+            return
+
+        self.flush()
+        self._file.close()
+        self._file = None
+        logger.info(f"Closed traffic capture {self.path}")
+
+
+def read_capture(path: str) -> Iterator[CaptureRecord]:
+    """
+    Reads the records from a capture file in the order they were written.
+    """
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield CaptureRecord.from_line(line)
+
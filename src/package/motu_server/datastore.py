@@ -1,8 +1,9 @@
 import json
 import logging
 import datetime
+from fnmatch import fnmatchcase
 from tornado.locks import Condition, Lock
-from typing import Optional, Union, Any
+from typing import Callable, Optional, Union, Any
 
 # Typing of datastore dictionary
 # keys are strings, values can be dictionaries, string, float, int
@@ -41,19 +42,30 @@ class ETag:
         async with self.tag_lock:
             return self._value
 
-    async def increment(self, client_id: Optional[int]=None) -> None:
+    async def increment(self, client_id: Optional[int]=None, lap: Optional[Callable[[str], None]]=None) -> None:
         """
         Increment the eTag, optionally with a client
         identifier to determine which client made the update.
+        If lap is given, it is called as each phase completes.
         """
         async with self.tag_lock:
+            if lap is not None:
+                lap("lock")
+
             self._value += 1
             if client_id is not None:
                 self._client_id = client_id
 
         logger.info(f"{client_id}: New eTag value: {self._value}, set by {self._client_id}")
+
+        if lap is not None:
+            lap("log")
+
         self.tag_condition.notify_all()
 
+        if lap is not None:
+            lap("notify")
+
 
 class Datastore:
     """
@@ -106,10 +118,14 @@ class Datastore:
 
         return res
     
-    def parse_value(self, value: str) -> Union[str, int, float]:
+    def parse_value(self, value: Union[str, int, float]) -> Union[str, int, float]:
         """
         Parses a value as integar, float or stirng from the given value.
+        Values that are already numbers are returned unchanged.
         """
+        if not isinstance(value, str):
+            return value
+
         try:
             return int(value)
         except ValueError:
@@ -118,9 +134,10 @@ class Datastore:
             except ValueError:
                 return value
     
-    def _expand_tree(self, values: dict, base_path:Optional[str]=None) -> DatastoreDict:
+    def _expand_tree(self, values: dict[str, Any], base_path:Optional[str]=None, parse: bool=True) -> DatastoreDict:
         """
         Expands the given dictionary of paths into a dictionary.
+        Values are parsed with parse_value unless parse is False.
 
         e.g.
 
@@ -130,18 +147,18 @@ class Datastore:
 
         { "mix": { "chan": { "0": { "name": "Channel Name" }}}}
         """
-        def _insert_tree(r, parts, value):
-            """
-            Recursively insert the values into the tree
-            """
-            r[parts[0]] = self.parse_value(value) if len(parts) == 1 else _insert_tree(r.get(parts[0], {}), parts[1:], value)
-            return r
-
         res: DatastoreDict = {}
+        base_parts = base_path.split("/") if base_path else []
 
         for k, v in values.items():
-            parts = (base_path.split("/") if base_path else []) + (k.split("/") if k != "value" else [])            
-            _insert_tree(res, parts, v)
+            parts = base_parts + (k.split("/") if k != "value" else [])
+
+            # Walk down the tree, creating levels as needed, then set the leaf.
+            current_level = res
+            for level in parts[:-1]:
+                current_level = current_level.setdefault(level, {})
+
+            current_level[parts[-1]] = self.parse_value(v) if parse else v
 
         return res
     
@@ -175,16 +192,82 @@ class Datastore:
         else:
             return { "value": current_level }
 
-    def read(self, path: str="") -> DatastoreDict:
+    def _read_paths(self, datastore: DatastoreDict, paths: list[str], path: str="") -> DatastoreDict:
+        """
+        Read the values matching any of the given paths, relative to the given path,
+        from the given datastore. Paths may contain glob patterns for any level,
+        e.g. mix/chan/*/matrix/aux/0/send.
+
+        The paths are combined into a tree of levels so that the datastore is only
+        walked once, however many paths are requested.
+        """
+        # None marks the end of a requested path.
+        requested: dict = {}
+        for p in paths:
+            node = requested
+            for level in (p.strip("/").split("/") if p.strip("/") else []):
+                node = node.setdefault(level, {})
+            node[None] = True
+
+        current_level = datastore
+        if path != "":
+            for level in path.split("/"):
+                current_level = current_level.get(level, {}) if isinstance(current_level, dict) else {}
+
+        res: DatastoreDict = {}
+        self._collect_paths(current_level, [requested], "", res)
+        return res
+
+    def _collect_paths(self, tree: Any, nodes: list[dict], base_path: str, res: DatastoreDict) -> None:
+        """
+        Recursively collect the values of the tree matching any of the requested nodes.
+        """
+        if any(None in node for node in nodes):
+            # A requested path ends here, so everything below it is included.
+            if isinstance(tree, dict):
+                res.update(self._flatten_tree(tree, base_path))
+            elif base_path != "":
+                res[base_path] = tree
+            return
+
+        if not isinstance(tree, dict):
+            return
+
+        # Group the requested levels by the datastore keys they match.
+        matches: dict[str, list[dict]] = {}
+        for node in nodes:
+            for level, child in node.items():
+                if level is None:
+                    continue
+
+                if any(c in level for c in "*?["):
+                    for k in tree:
+                        if fnmatchcase(k, level):
+                            matches.setdefault(k, []).append(child)
+                elif level in tree:
+                    matches.setdefault(level, []).append(child)
+
+        for k, children in matches.items():
+            self._collect_paths(tree[k], children, f"{base_path}/{k}" if base_path != "" else k, res)
+
+    def read(self, path: str="", paths: Optional[list[str]]=None) -> DatastoreDict:
         """
         Read datastore values at the given path. If none given, read all values.
+        If paths are given, only read the values matching them under the path.
         """
+        if paths is not None:
+            return self._read_paths(self._datastore, paths, path)
+
         return self._read(self._datastore, path)
         
-    def read_last_update(self, path: str="") -> DatastoreDict:
+    def read_last_update(self, path: str="", paths: Optional[list[str]]=None) -> DatastoreDict:
         """
-        Read the last updated values at the given path.
+        Read the last updated values at the given path, optionally
+        only those matching the given paths.
         """
+        if paths is not None:
+            return self._read_paths(self.last_update, paths, path)
+
         return self._read(self.last_update, path)
         
     async def wait_for_updates(self, timeout:Union[int, datetime.timedelta]=15) -> bool:
@@ -200,16 +283,62 @@ class Datastore:
         self,
         base_path: str,
         values: dict[str, Union[str, float, int]],
-        client_id: Optional[int]=None
+        client_id: Optional[int]=None,
+        lap: Optional[Callable[[str], None]]=None
     ) -> None:
         """
         Write the values under the given base path.
+        If lap is given, it is called with the name of each phase
+        (lock, apply, log, notify) as it completes, for request timings.
         """
         async with self.datastoreLock:
-            updates = self._expand_tree(values, base_path)
-            self._update_nested(self._datastore, updates)
-            self.last_update = updates.copy()
+            if lap is not None:
+                lap("lock")
+
+            self._write_unlocked(base_path, values)
 
-        await self.etag.increment(client_id)
+            if lap is not None:
+                lap("apply")
+
+        await self.etag.increment(client_id, lap=lap)
+
+    async def write_changes(self, values: DatastoreDict, client_id: Optional[int]=None) -> DatastoreDict:
+        """
+        Write flat values, keyed by full path, that differ from the current state.
+
+        Values are written as they are, without parse_value, as they are expected
+        to already have their stored types. The comparison and write happen under
+        the datastore lock as one update, so waiting clients are woken once with
+        a single delta. Returns the values that were changed. If none were, the
+        eTag is not incremented.
+        """
+        missing = object()
+
+        async with self.datastoreLock:
+            changes: DatastoreDict = {}
+            for path, value in values.items():
+                current_level: Any = self._datastore
+                for level in path.split("/"):
+                    current_level = current_level.get(level, missing) if isinstance(current_level, dict) else missing
+
+                if current_level != value:
+                    changes[path] = value
+
+            if changes:
+                self._write_unlocked("", changes, parse=False)
+
+        if changes:
+            await self.etag.increment(client_id)
+
+        return changes
+
+    def _write_unlocked(self, base_path: str, values: dict[str, Any], parse: bool=True) -> None:
+        """
+        Write the values under the given base path without taking the
+        datastore lock or incrementing the eTag. The caller must hold the lock.
+        """
+        updates = self._expand_tree(values, base_path, parse)
+        self._update_nested(self._datastore, updates)
+        self.last_update = updates.copy()
 
     
\ No newline at end of file
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+from typing import Any, Optional
+from motu_server.datastore import Datastore, DatastoreDict
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Datastore path listing the device presets as "id:name:id:name..."
+DEVICE_PRESETS_PATH = "ext/presets/device"
+
+# Subtrees of the datastore that are stored in a preset.
+DEFAULT_PRESET_ROOTS = ("mix",)
+
+
+class Preset:
+    """
+    A stored device preset.
+
+    Values are held flat, keyed by full datastore path, with the
+    types they had in the datastore when the preset was saved.
+    """
+    __slots__ = ("preset_id", "name", "values")
+
+    def __init__(self, preset_id: int, name: str, values: Optional[DatastoreDict]=None) -> None:
+        self.preset_id = preset_id
+        self.name = name
+        self.values: DatastoreDict = values or {}
+
+    @property
+    def has_state(self) -> bool:
+        """
+        Whether any state has been saved to the preset.
+        """
+        return bool(self.values)
+
+
+class PresetStore:
+    """
+    Saves and recalls device presets against a datastore.
+
+    Saving a preset captures the current values under the preset
+    roots. Recalling compares the preset with the current state and
+    writes only the values that differ, in a single datastore update,
+    so that waiting clients are woken once with one delta no matter
+    how many paths the preset changes.
+
+    If a path is given, presets are loaded from and saved to that json
+    file. Otherwise they are only kept in memory, and presets listed in
+    the datastore have no state to recall until they are saved.
+    """
+    def __init__(
+        self,
+        datastore: Datastore,
+        path: Optional[str]=None,
+        roots: tuple[str, ...]=DEFAULT_PRESET_ROOTS
+    ) -> None:
+        self.datastore = datastore
+        self.path = path
+        self.roots = roots
+        self.presets: dict[int, Preset] = {}
+
+        for preset_id, name in self._parse_device_presets(datastore.read(DEVICE_PRESETS_PATH).get("value")).items():
+            self.presets[preset_id] = Preset(preset_id, name)
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for preset_id, preset in json.load(f).items():
+                    self.presets[int(preset_id)] = Preset(int(preset_id), preset["name"], preset["values"])
+
+            logger.info(f"Loaded {len(self.presets)} presets from file {path}")
+
+    def _parse_device_presets(self, value: Any) -> dict[int, str]:
+        """
+        Parses the device preset list, e.g.
+
+        "1001:Preset1:1002:Preset2"
+
+        becomes:
+
+        { 1001: "Preset1", 1002: "Preset2" }
+        """
+        if not isinstance(value, str) or value == "":
+            return {}
+
+        parts = value.split(":")
+        return {int(parts[i]): parts[i + 1] for i in range(0, len(parts) - 1, 2)}
+
+    def _device_presets_value(self) -> str:
+        """
+        Formats the presets as the device preset list.
+        """
+        return ":".join(f"{p.preset_id}:{p.name}" for p in sorted(self.presets.values(), key=lambda p: p.preset_id))
+
+    def _save_file(self) -> None:
+        """
+        Writes the presets with saved state to the presets file, if there is one.
+        """
+        if not self.path:
+            return
+
+        with open(self.path, "w") as f:
+            json.dump({
+                str(p.preset_id): {"name": p.name, "values": p.values}
+                for p in self.presets.values()
+                if p.has_state
+            }, f)
+
+    def list(self) -> dict[int, str]:
+        """
+        Returns the names of the known presets keyed by identifier.
+        """
+        return {preset_id: p.name for preset_id, p in sorted(self.presets.items())}
+
+    async def save(self, preset_id: int, name: Optional[str]=None, client_id: Optional[int]=None) -> Preset:
+        """
+        Saves the current state to the given preset, creating it if needed.
+
+        Raises ValueError if the name contains a colon, as it
+        separates the entries of the device preset list.
+        """
+        if name is not None and ":" in name:
+            raise ValueError(f"Preset name '{name}' must not contain ':'")
+
+        existing = self.presets.get(preset_id)
+        name = name or (existing.name if existing else f"Preset{preset_id}")
+
+        values = self.datastore.read(paths=list(self.roots))
+        preset = Preset(preset_id, name, values)
+        self.presets[preset_id] = preset
+        self._save_file()
+        logger.info(f"{client_id}: Saved {len(values)} values to preset {preset_id} '{name}'")
+
+        if existing is None or existing.name != name:
+            await self.datastore.write(DEVICE_PRESETS_PATH, {"value": self._device_presets_value()}, client_id=client_id)
+
+        return preset
+
+    async def recall(self, preset_id: int, client_id: Optional[int]=None) -> DatastoreDict:
+        """
+        Recalls the given preset, returning the values that were changed.
+
+        Raises KeyError if the preset does not exist and ValueError
+        if it has no saved state.
+        """
+        preset = self.presets[preset_id]
+
+        if not preset.has_state:
+            raise ValueError(f"Preset {preset_id} has no saved state")
+
+        changes = await self.datastore.write_changes(preset.values, client_id=client_id)
+
+        if changes:
+            logger.info(f"{client_id}: Recalled preset {preset_id} '{preset.name}', {len(changes)} values changed")
+        else:
+            logger.info(f"{client_id}: Preset {preset_id} matches current state, nothing to recall")
+
+        return changes
@@ -0,0 +1,250 @@
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Any, Optional
+import tornado.web
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Only one profile can run at a time as cProfile can't be nested.
+_profile_lock = threading.Lock()
+
+# The shortest sampling or monitoring interval, in seconds, so
+# that background threads never spin.
+MIN_INTERVAL = 0.001
+
+
+class ProfilerBusyError(Exception):
+    """
+    Raised when a profile is requested while another is running.
+    """
+
+
+class RequestTimer:
+    """
+    Breaks down the time taken to handle a request into phases.
+
+    Each call to lap attributes the time since the previous lap to
+    the given phase.
+    """
+    __slots__ = ("start", "_last", "phases")
+
+    def __init__(self) -> None:
+        self.start: float = time.perf_counter()
+        self._last: float = self.start
+        self.phases: dict[str, float] = {}
+
+    def lap(self, phase: str) -> None:
+        """
+        Attributes the time since the last lap to the given phase.
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + (now - self._last)
+        self._last = now
+
+    def server_timing(self) -> str:
+        """
+        Formats the phases as a Server-Timing header value, in milliseconds.
+        """
+        phases = [f"{phase};dur={duration * 1000:.3f}" for phase, duration in self.phases.items()]
+        phases.append(f"total;dur={(self._last - self.start) * 1000:.3f}")
+        return ", ".join(phases)
+
+
+def _frame_name(frame: FrameType) -> str:
+    """
+    Describes the function a frame is executing.
+    """
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame: Optional[FrameType]) -> str:
+    """
+    Formats a stack as a single line, outermost frame first,
+    with frames separated by semicolons.
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+def find_request(frame: Optional[FrameType]) -> tuple[Optional[str], Optional[str]]:
+    """
+    Finds the innermost request handler in a stack, returning
+    the handler's class name and the path of its request.
+    """
+    while frame is not None:
+        handler = frame.f_locals.get("self")
+        if isinstance(handler, tornado.web.RequestHandler):
+            return type(handler).__name__, handler.request.path
+        frame = frame.f_back
+
+    return None, None
+
+
+async def sample_stacks(seconds: float, interval: float=0.005, thread_id: Optional[int]=None) -> dict[str, int]:
+    """
+    Samples the stack of the given thread, by default the current one,
+    every interval seconds for the given number of seconds. Returns the
+    number of times each collapsed stack was seen.
+
+    Sampling runs in a separate thread so that the event loop carries on
+    handling requests while it is sampled.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+
+    interval = max(interval, MIN_INTERVAL)
+    thread_id = thread_id if thread_id is not None else threading.get_ident()
+    counts: collections.Counter = collections.Counter()
+    stop = threading.Event()
+
+    def _sample() -> None:
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                counts[collapse_stack(frame)] += 1
+
+    sampler = threading.Thread(target=_sample, name="motu-stack-sampler", daemon=True)
+    try:
+        sampler.start()
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        sampler.join()
+        _profile_lock.release()
+
+    return dict(counts)
+
+
+def format_collapsed(counts: dict[str, int]) -> str:
+    """
+    Formats stack counts as collapsed stacks, one per line,
+    suitable for flame graph tools.
+    """
+    return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items(), key=lambda i: -i[1]))
+
+
+async def profile_pstats(seconds: float, sort: str="cumulative", limit: int=50) -> str:
+    """
+    Profiles everything run by the event loop for the given
+    number of seconds, returning the pstats report.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+        _profile_lock.release()
+
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+class LoopLagMonitor:
+    """
+    Records callbacks that hold up the event loop.
+
+    A task on the event loop wakes every interval seconds. If it wakes
+    threshold seconds or more late, the loop was blocked and a record is
+    kept of the lag. A watchdog thread samples the event loop's stack
+    while it is blocked, so each record also has the stack of the slow
+    callback and the handler and path of the request it was serving.
+    """
+    def __init__(self, interval: float=0.05, threshold: float=0.1, max_records: int=100) -> None:
+        self.interval = max(interval, MIN_INTERVAL)
+        self.threshold = threshold
+        self.records: collections.deque = collections.deque(maxlen=max_records)
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._thread_id: Optional[int] = None
+        self._last_beat: float = 0.0
+        self._blocked_sample: Optional[dict[str, Any]] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self) -> None:
+        """
+        Starts monitoring the running event loop.
+        """
+        if self.running:
+            return
+
+        self._thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name="motu-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started, threshold {self.threshold * 1000:.0f}ms")
+
+    def stop(self) -> None:
+        """
+        Stops monitoring. Records are kept until the monitor is discarded.
+        """
+        if not self.running:
+            return
+
+        assert self._task is not None and self._watchdog is not None
+        self._task.cancel()
+        self._task = None
+        self._stop.set()
+        self._watchdog.join()
+        self._watchdog = None
+        logger.info("Event loop lag monitor stopped")
+
+    async def _beat(self) -> None:
+        """
+        Wakes every interval and records how late it was.
+        """
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_beat = now = time.monotonic()
+            lag = now - expected
+
+            sample, self._blocked_sample = self._blocked_sample, None
+            if lag >= self.threshold:
+                record = {"time": time.time(), "lag": lag, "handler": None, "path": None, "stack": None}
+                if sample is not None:
+                    record.update(sample)
+                self.records.append(record)
+
+                culprit = f" serving {record['handler']} {record['path']}" if record["handler"] else ""
+                logger.warning(f"Event loop blocked for {lag * 1000:.1f}ms{culprit}")
+
+    def _watch(self) -> None:
+        """
+        Samples the event loop's stack when it has stopped beating.
+        """
+        while not self._stop.wait(self.interval):
+            if self._blocked_sample is not None:
+                continue
+
+            if time.monotonic() - self._last_beat < self.interval + self.threshold:
+                continue
+
+            assert self._thread_id is not None
+            frame = sys._current_frames().get(self._thread_id)
+            handler, path = find_request(frame)
+            self._blocked_sample = {"handler": handler, "path": path, "stack": collapse_stack(frame)}
@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+import urllib.parse
+from typing import Any, Optional, Union
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from motu_server.capture import CaptureRecord, read_capture
+from motu_server.server import make_app, setupDatastore
+
+logger: logging.Logger = logging.getLogger(__name__)
+
+# Client ids for each copy of the captured clients are offset
+# by this amount so that virtual clients don't collide.
+VIRTUAL_CLIENT_STRIDE = 100000
+
+# Long polls can be held by the server for up to 15 seconds.
+REQUEST_TIMEOUT = 30.0
+
+
+def _category(record: CaptureRecord) -> str:
+    """
+    Groups requests for reporting. GETs sent with an etag
+    are long polls and are reported separately from plain reads.
+    """
+    if record.method == "GET" and record.request_etag is not None:
+        return "POLL"
+
+    return record.method
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not values:
+        return 0.0
+
+    index = min(len(values) - 1, max(0, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+def summarise_latencies(latencies: list[float], elapsed: float) -> dict[str, float]:
+    """
+    Summarises a list of latencies, in seconds, over the given elapsed time.
+    """
+    ordered = sorted(latencies)
+    return {
+        "count": len(ordered),
+        "throughput": len(ordered) / elapsed if elapsed > 0 else 0.0,
+        "mean": sum(ordered) / len(ordered) if ordered else 0.0,
+        "p50": _percentile(ordered, 50),
+        "p90": _percentile(ordered, 90),
+        "p99": _percentile(ordered, 99),
+        "max": ordered[-1] if ordered else 0.0,
+    }
+
+
+def make_report(
+    results: list[tuple[str, float, float, int]],
+    elapsed: float
+) -> dict[str, Any]:
+    """
+    Builds a report from (category, latency, queue time, status) results.
+    Latency excludes the time a request was queued in the replay client
+    waiting for a free connection, which is reported separately.
+    """
+    by_category: dict[str, list[float]] = {}
+    for category, latency, _, _ in results:
+        by_category.setdefault(category, []).append(latency)
+
+    return {
+        "elapsed": elapsed,
+        "errors": sum(1 for _, _, _, status in results if status >= 400 or status == 599),
+        "queue": summarise_latencies([queue for _, _, queue, _ in results], elapsed),
+        "all": summarise_latencies([latency for _, latency, _, _ in results], elapsed),
+        "categories": {
+            category: summarise_latencies(latencies, elapsed)
+            for category, latencies in sorted(by_category.items())
+        },
+    }
+
+
+def compare_reports(report: dict[str, Any], baseline: dict[str, Any]) -> dict[str, Any]:
+    """
+    Compares a report with a baseline report, returning the
+    percentage change of each metric for each category.
+    """
+    def _diff(current: dict[str, float], previous: dict[str, float]) -> dict[str, Optional[float]]:
+        return {
+            k: ((v - previous[k]) / previous[k] * 100.0) if previous.get(k) else None
+            for k, v in current.items()
+            if k in previous
+        }
+
+    return {
+        "all": _diff(report["all"], baseline["all"]),
+        "categories": {
+            category: _diff(stats, baseline["categories"][category])
+            for category, stats in report["categories"].items()
+            if category in baseline["categories"]
+        },
+    }
+
+
+class ReplayDriver:
+    """
+    Plays the requests in a capture back against a server.
+
+    Each request is sent at its captured offset divided by speed,
+    so that speed=2 replays the capture in half the time. The captured
+    clients are repeated clients times, each copy using its own client ids.
+
+    Long polls are sent with the last Etag the virtual client received
+    rather than the captured one, as the server's eTag moves on faster
+    than it did in the capture when several copies of the clients write.
+
+    Each virtual client walks its own records in order, starting each
+    request when it is due without waiting for earlier ones, so only the
+    requests in flight are held in memory. At most max_connections
+    requests are sent at once; the rest queue in the replay client.
+    """
+    def __init__(
+        self,
+        records: list[CaptureRecord],
+        base_url: str,
+        speed: float=1.0,
+        clients: int=1,
+        max_connections: int=1000
+    ) -> None:
+        self.records = sorted(records, key=lambda r: r.offset)
+        self.base_url = base_url.rstrip("/")
+        self.speed = speed
+        self.clients = clients
+        self.http_client = AsyncHTTPClient(force_instance=True, max_clients=max_connections)
+        self.etags: dict[tuple[int, Optional[Union[int, str]]], str] = {}
+        self.results: list[tuple[str, float, float, int]] = []
+
+    def _make_request(self, record: CaptureRecord, client_offset: int) -> HTTPRequest:
+        """
+        Builds the http request for a captured record.
+        """
+        args: dict[str, str] = {}
+        if isinstance(record.client, int):
+            args["client"] = str(record.client + client_offset)
+        elif record.client is not None:
+            args["client"] = record.client
+        if record.body is not None:
+            args["json" if record.method == "PATCH" else "paths"] = record.body
+
+        url = f"{self.base_url}/datastore/{record.path}"
+        if args:
+            url = f"{url}?{urllib.parse.urlencode(args)}"
+
+        headers = {}
+        if record.request_etag is not None:
+            headers["If-None-Match"] = self.etags.get((client_offset, record.client), record.request_etag)
+
+        return HTTPRequest(
+            url,
+            method=record.method,
+            headers=headers,
+            body="" if record.method == "PATCH" else None,
+            request_timeout=REQUEST_TIMEOUT,
+            # Requests queued for a connection time out after the connect timeout.
+            connect_timeout=REQUEST_TIMEOUT,
+        )
+
+    async def _send(self, record: CaptureRecord, client_offset: int) -> None:
+        """
+        Sends a request, recording its category, latency,
+        time queued for a connection and http status.
+        """
+        request = self._make_request(record, client_offset)
+        sent = time.monotonic()
+        latency: Optional[float] = None
+        try:
+            response = await self.http_client.fetch(request, raise_error=False)
+            status = response.code
+            # request_time excludes time queued waiting for a connection.
+            latency = response.request_time
+
+            etag = response.headers.get("Etag")
+            if etag is not None:
+                self.etags[(client_offset, record.client)] = etag
+        except HTTPClientError as e:
+            # Timeouts and connection errors are raised with code 599
+            status = e.code
+        except Exception as e:
+            logger.error(f"Replay of {record.method} {record.path} failed: {e}")
+            status = 599
+
+        total = time.monotonic() - sent
+        if latency is None:
+            latency = total
+        self.results.append((_category(record), latency, max(0.0, total - latency), status))
+
+    async def _run_client(self, records: list[CaptureRecord], client_offset: int, start: float) -> None:
+        """
+        Starts each of a virtual client's requests when it is due,
+        then waits for those still in flight.
+        """
+        in_flight: set[asyncio.Task] = set()
+
+        for record in records:
+            delay = start + record.offset / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            task = asyncio.create_task(self._send(record, client_offset))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def run(self) -> dict[str, Any]:
+        """
+        Replays the capture and returns a report of latency and throughput.
+        """
+        if not self.records:
+            return make_report([], 0.0)
+
+        by_client: dict[Optional[Union[int, str]], list[CaptureRecord]] = {}
+        for record in self.records:
+            by_client.setdefault(record.client, []).append(record)
+
+        # Start from the first captured request rather than the start of the capture.
+        first_offset = self.records[0].offset
+        start = time.monotonic() - first_offset / self.speed
+
+        self.results = []
+        await asyncio.gather(*(
+            self._run_client(records, copy * VIRTUAL_CLIENT_STRIDE, start)
+            for copy in range(self.clients)
+            for records in by_client.values()
+        ))
+        elapsed = time.monotonic() - start - first_offset / self.speed
+        self.http_client.close()
+
+        return make_report(self.results, elapsed)
+
+
+async def replay_against_app(
+    records: list[CaptureRecord],
+    datastore: Optional[str]=None,
+    speed: float=1.0,
+    clients: int=1,
+    max_connections: int=1000
+) -> dict[str, Any]:
+    """
+    Starts the server application in process on an unused port
+    and replays the capture against it.
+    """
+    setupDatastore(path=datastore)
+    sockets = bind_sockets(0, "127.0.0.1")
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(make_app())
+    server.add_sockets(sockets)
+
+    try:
+        driver = ReplayDriver(
+            records, f"http://127.0.0.1:{port}",
+            speed=speed, clients=clients, max_connections=max_connections
+        )
+        return await driver.run()
+    finally:
+        server.stop()
+        await server.close_all_connections()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        prog="motu_server.replay",
+        description="Replay a captured traffic file against the server and report latency and throughput"
+    )
+    parser.add_argument("capture", type=str, help="The capture file to replay")
+    parser.add_argument("--datastore", type=str, help="The initial datastore for the in-process server")
+    parser.add_argument("--url", type=str, help="Replay against a running server at this url instead of in process")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier")
+    parser.add_argument("--clients", type=int, default=1, help="Number of copies of the captured clients to run concurrently")
+    parser.add_argument("--max-connections", type=int, default=1000, help="Maximum number of requests in flight at once")
+    parser.add_argument("--output", type=str, help="Write the report to this file")
+    parser.add_argument("--baseline", type=str, help="A report from a previous replay to compare against")
+    args = parser.parse_args()
+
+    # Only show warnings, so the in process server doesn't log every replayed request.
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    records = list(read_capture(args.capture))
+
+    if args.url:
+        report = asyncio.run(ReplayDriver(
+            records, args.url, speed=args.speed, clients=args.clients, max_connections=args.max_connections
+        ).run())
+    else:
+        report = asyncio.run(replay_against_app(
+            records, args.datastore, speed=args.speed, clients=args.clients, max_connections=args.max_connections
+        ))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["comparison"] = compare_reports(report, json.load(f))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
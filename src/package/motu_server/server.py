@@ -3,18 +3,27 @@ import tornado
 import logging
 import json
 import datetime
-from typing import Optional
+from typing import Optional, Union
 from motu_server.datastore import Datastore
+from motu_server.capture import TrafficCapture
+from motu_server.presets import PresetStore
+from motu_server.profiling import (
+    MIN_INTERVAL, LoopLagMonitor, ProfilerBusyError, RequestTimer, format_collapsed, profile_pstats, sample_stacks
+)
 from motu_server.zeroconf_registration import MotuZeroConfRegistration
 
 logger = logging.getLogger(__name__)
 
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[logging.FileHandler("motu_server.log"), logging.StreamHandler()],
-)
+def setupLogging():
+    """
+    Sets up logging to the console and motu_server.log when running the server.
+    """
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[logging.FileHandler("motu_server.log"), logging.StreamHandler()],
+    )
 
 
 class ServerObjects:
@@ -23,17 +32,25 @@ class ServerObjects:
 
     Datastore: The motu avb datastore containing the device state.
     Clients: Known clients of the server.
+    Capture: Records datastore traffic when enabled.
+    Presets: Device presets saved from and recalled to the datastore.
+    LagMonitor: Records slow event loop callbacks when started from the admin api.
     """
     datastore: Datastore = Datastore()
     clients: dict[int, dict] = {}
+    presets: PresetStore = PresetStore(datastore)
+    lag_monitor: Optional[LoopLagMonitor] = None
+    capture: Optional[TrafficCapture] = None
 
 
-def setupDatastore(path: Optional[str]="./datastore.json"):
+def setupDatastore(path: Optional[str]="./datastore.json", presets: Optional[str]=None):
     """
-    Sets up an initial datastore for use by the server.
+    Sets up an initial datastore for use by the server, with
+    presets stored in the given file, if provided.
     """
     ServerObjects.datastore = Datastore(path)
     ServerObjects.clients = {}
+    ServerObjects.presets = PresetStore(ServerObjects.datastore, presets)
 
 
 class ApiVersionHandler(tornado.web.RequestHandler):
@@ -41,18 +58,20 @@ class ApiVersionHandler(tornado.web.RequestHandler):
         self.write("0.0.0")
 
 
-class DatastoreHandler(tornado.web.RequestHandler):
+class BaseHandler(tornado.web.RequestHandler):
     """
-    Handles GET and PATCH requests for the AVB datastore.
+    Common CORS and client handling for the AVB API handlers.
     """
+    response_etag: Optional[str] = None
+
     def set_default_headers(self):
         """
         Set CORS headers for all requests.
         """
         self.set_header("Access-Control-Allow-Origin", "*")
-        self.set_header("Access-Control-Allow-Headers", "if-none-match")
+        self.set_header("Access-Control-Allow-Headers", "if-none-match, x-debug-timing")
         self.set_header('Access-Control-Allow-Methods', 'POST, PATCH, GET, OPTIONS')
-        self.set_header('Access-Control-Expose-Headers', "Etag")
+        self.set_header('Access-Control-Expose-Headers', "Etag, Server-Timing")
 
     def _get_client_id(self) -> Optional[int]:
         """
@@ -74,31 +93,156 @@ class DatastoreHandler(tornado.web.RequestHandler):
         
         return client_id
 
+    def _set_etag(self, value: int) -> None:
+        """
+        Sets the Etag header, keeping the value for the traffic capture.
+        """
+        self.response_etag = str(value)
+        self.set_header("Etag", self.response_etag)
+
+    async def options(self, *args):
+        """
+        For OPTIONS requests, set defult cors headers (using set_default_headers)
+        and return 200/OK.
+        """
+        self.set_status(200)
+        self.finish()
+
+
+class DatastoreHandler(BaseHandler):
+    """
+    Handles GET and PATCH requests for the AVB datastore.
+    """
+    timer: Optional[RequestTimer] = None
+
+    def prepare(self):
+        """
+        When the admin api is enabled, time requests sent with
+        an X-Debug-Timing header and return the timings in a
+        Server-Timing header.
+        """
+        if self.settings.get("admin") and "X-Debug-Timing" in self.request.headers:
+            self.timer = RequestTimer()
+
+    def on_finish(self):
+        """
+        Logs the request timings and records the request
+        to the traffic capture, if enabled.
+        """
+        if self.timer is not None:
+            # Writing out happens after the headers are sent, so is only logged.
+            self.timer.lap("write")
+            logger.debug(f"{self.request.method} {self.request.path} timings: {self.timer.server_timing()}")
+
+        if ServerObjects.capture is None or self.request.method not in ("GET", "PATCH"):
+            return
+
+        # Record requests with a client that isn't a number as they were sent.
+        client: Optional[Union[int, str]] = self.get_argument("client", None)
+        try:
+            client = int(client) if client is not None else None
+        except ValueError:
+            pass
+
+        if self.request.method == "PATCH":
+            body = self.get_argument("json", None)
+        else:
+            body = ",".join(self.get_arguments("paths")) or None
+        ServerObjects.capture.record(
+            self.request.method,
+            self.path_args[0] if self.path_args else "",
+            client,
+            self.request.headers.get("If-None-Match", None),
+            self.response_etag,
+            self.get_status(),
+            self.request.request_time(),
+            body
+        )
+
+    def _get_paths(self) -> Optional[list[str]]:
+        """
+        Determines the paths requested in the querystring arguments, if any.
+        Paths can be given as repeated "paths" arguments or separated by commas.
+        """
+        paths = [p for argument in self.get_arguments("paths") for p in argument.split(",") if p != ""]
+        return paths or None
+
+    def _lap(self, phase: str) -> None:
+        """
+        Attributes the time since the last lap to the given phase,
+        if the request is being timed.
+        """
+        if self.timer is not None:
+            self.timer.lap(phase)
+
+    async def _etag_value(self) -> int:
+        """
+        The current value of the datastore eTag. The time waiting
+        for the eTag lock is recorded, so callers should lap
+        any work done beforehand.
+        """
+        value = await ServerObjects.datastore.etag.value
+        self._lap("lock")
+        return value
+
+    def _set_server_timing(self) -> None:
+        """
+        Sets the Server-Timing header, if the request is being timed.
+        """
+        if self.timer is not None:
+            self.set_header("Server-Timing", self.timer.server_timing())
+
+    def _write_values(self, values: dict) -> None:
+        """
+        Writes the values as json. When the request is timed,
+        the time taken reading and encoding the values is recorded.
+        """
+        if self.timer is None:
+            self.write(values)
+            return
+
+        self.timer.lap("read")
+        body = tornado.escape.json_encode(values)
+        self.timer.lap("encode")
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self._set_server_timing()
+        self.write(body)
+
     async def get(self, path:str=""):
         """
         Retrieve datastore data at the given path.
+
+        If the "paths" argument is given, only the values matching those
+        paths or glob patterns under the given path are returned.
         """
         client_id = self._get_client_id()        
+        paths = self._get_paths()
         
         last_etag_str: Optional[str] = self.request.headers.get("If-None-Match", None)
-        server_etag = await ServerObjects.datastore.etag.value
+        self._lap("parse")
+        server_etag = await self._etag_value()
 
         if last_etag_str is None or ServerObjects.datastore.parse_value(last_etag_str) != server_etag:
             # Etag was not sent or they don't match, read entire datastore.
             logger.info(f"{client_id}: Returning data as etags dont match. Header: {last_etag_str}, Datastore: {server_etag}")
-            self.set_header("Etag", str(await ServerObjects.datastore.etag.value))
-            self.write(ServerObjects.datastore.read(path))
+            self._lap("log")
+            self._set_etag(await self._etag_value())
+            self._write_values(ServerObjects.datastore.read(path, paths))
             return
 
         # When there's an "If-None_Match" header containing the last etag, the client is long polling.
         # In this case, if the provided eTag matches the current eTag, wait up to 15 seconds for updates.
         logger.info(f"{client_id}: etag {last_etag_str} matches server - long poll call waiting 15 seconds for updates.")
+        self._lap("log")
         
         remainingTime = datetime.timedelta(seconds=15)
         startTime = datetime.datetime.now()
 
         while remainingTime > datetime.timedelta(seconds=0):
-            if not await ServerObjects.datastore.wait_for_updates(timeout=remainingTime):
+            updated = await ServerObjects.datastore.wait_for_updates(timeout=remainingTime)
+            self._lap("wait")
+
+            if not updated:
                 # If wait_for_updates returned False, condition.notify_all was not called.
                 # Therefore, as no updates were made before the timeout, Return an http/304.
                 break
@@ -107,16 +251,19 @@ class DatastoreHandler(tornado.web.RequestHandler):
             # Filter out updates from the same client or any that aren't relevant
             # to the scope of the request (ie not under the same path).
             updated_by = await ServerObjects.datastore.etag.updated_by
+            self._lap("lock")
             
             if updated_by != client_id:                
                 # An update was received after being made by another client.
                 # Return only the updates that are relevant to the client.
                 logger.info(f"{client_id}: New data received after update by {updated_by}.")                
-                updates = ServerObjects.datastore.read_last_update(path)
+                self._lap("log")
+                updates = ServerObjects.datastore.read_last_update(path, paths)
+                self._lap("read")
                 
                 if updates:
-                    self.set_header("Etag", str(await ServerObjects.datastore.etag.value))
-                    self.write(updates)
+                    self._set_etag(await self._etag_value())
+                    self._write_values(updates)
                     return
 
                 logger.info(f"{client_id}: No relevant updates were made so continuing to wait.")
@@ -131,19 +278,14 @@ class DatastoreHandler(tornado.web.RequestHandler):
             # having no updates before the timeout, so return an http/304
             remainingTime = max(datetime.timedelta(seconds=0), remainingTime - (datetime.datetime.now() - startTime))
             logger.info(f"{client_id}: Remaining time: {remainingTime}.")
+            self._lap("log")
 
         logger.info(f"{client_id}: Timed out waiting for update. Returning with HTTP/304 status.")
-        self.set_header("Etag", str(await ServerObjects.datastore.etag.value))
+        self._lap("log")
+        self._set_etag(await self._etag_value())
+        self._set_server_timing()
         self.set_status(304)
 
-    async def options(self, path:str=""):
-        """
-        For OPTIONS requests, set defult cors headers (using set_default_headers)
-        and return 200/OK.
-        """
-        self.set_status(200)
-        self.finish()
-
     async def patch(self, path:str=""):
         """
         handle patch request to update the data at the given path.
@@ -152,35 +294,201 @@ class DatastoreHandler(tornado.web.RequestHandler):
         """
         client_id = self._get_client_id()
         logger.info(f"{client_id}: Updating datastore at {path}")
+        self._lap("log")
         request_dict = json.loads(self.request.arguments["json"][0])
+        self._lap("parse")
+
+        await ServerObjects.datastore.write(
+            path, request_dict, client_id=client_id,
+            lap=self.timer.lap if self.timer is not None else None
+        )
+
+        self._set_etag(await self._etag_value())
+        self._set_server_timing()
+
+
+class PresetHandler(BaseHandler):
+    """
+    Lists, saves and recalls device presets.
+    """
+    async def get(self, preset_id:Optional[str]=None, action:Optional[str]=None):
+        """
+        List the known presets by identifier.
+        Presets can only be saved or recalled with POST.
+        """
+        if preset_id is not None or action is not None:
+            raise tornado.web.HTTPError(404)
+
+        self.write({str(k): v for k, v in ServerObjects.presets.list().items()})
+
+    async def post(self, preset_id:Optional[str]=None, action:Optional[str]=None):
+        """
+        Save the current state to, or recall, the given preset.
+
+        /presets/<id>/save?name=<name> saves the current state.
+        /presets/<id>/recall applies the preset in a single datastore update.
+        """
+        client_id = self._get_client_id()
+
+        if preset_id is None or action not in ("save", "recall"):
+            raise tornado.web.HTTPError(404)
+
+        if action == "save":
+            try:
+                preset = await ServerObjects.presets.save(int(preset_id), self.get_argument("name", None), client_id=client_id)
+            except ValueError as e:
+                raise tornado.web.HTTPError(400, str(e))
+            self.write({"id": preset.preset_id, "name": preset.name, "count": len(preset.values)})
+        else:
+            try:
+                changes = await ServerObjects.presets.recall(int(preset_id), client_id=client_id)
+            except KeyError:
+                raise tornado.web.HTTPError(404, f"Unknown preset {preset_id}")
+            except ValueError as e:
+                raise tornado.web.HTTPError(409, str(e))
+
+            self.write({"id": int(preset_id), "changed": len(changes)})
+
+        self._set_etag(await ServerObjects.datastore.etag.value)
+
+
+class AdminHandler(tornado.web.RequestHandler):
+    """
+    Common argument handling for the admin api handlers.
+    """
+    def _get_float_argument(self, name: str, default: float, minimum: float, maximum: Optional[float]=None) -> float:
+        """
+        Reads a number from the querystring arguments, returning
+        HTTP/400 if it isn't a number or is out of range.
+        """
+        try:
+            value = float(self.get_argument(name, str(default)))
+        except ValueError:
+            raise tornado.web.HTTPError(400, f"{name} must be a number")
+
+        if value < minimum or (maximum is not None and value > maximum):
+            limits = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+            raise tornado.web.HTTPError(400, f"{name} must be {limits}")
+
+        return value
 
-        await ServerObjects.datastore.write(path, request_dict, client_id=client_id)
 
-        self.set_header("Etag", str(await ServerObjects.datastore.etag.value))
+class ProfileHandler(AdminHandler):
+    """
+    Profiles the running server for a number of seconds.
+    """
+    async def get(self):
+        """
+        /admin/profile?seconds=5&format=collapsed samples the event loop's
+        stack, returning collapsed stacks. format=pstats instead returns
+        a cProfile report of everything run during the period.
+        """
+        seconds = self._get_float_argument("seconds", 5.0, minimum=MIN_INTERVAL, maximum=60.0)
+        output_format = self.get_argument("format", "collapsed")
+
+        try:
+            if output_format == "collapsed":
+                interval = self._get_float_argument("interval", 0.005, minimum=MIN_INTERVAL, maximum=seconds)
+                output = format_collapsed(await sample_stacks(seconds, interval))
+            elif output_format == "pstats":
+                output = await profile_pstats(seconds, sort=self.get_argument("sort", "cumulative"))
+            else:
+                raise tornado.web.HTTPError(400, f"Unknown format {output_format}")
+        except ProfilerBusyError as e:
+            raise tornado.web.HTTPError(409, str(e))
+
+        self.set_header("Content-Type", "text/plain; charset=UTF-8")
+        self.write(output)
 
 
-def make_app() -> tornado.web.Application:
-    return tornado.web.Application([
+class LagMonitorHandler(AdminHandler):
+    """
+    Starts, stops and reports the event loop lag monitor.
+    """
+    async def get(self, action:Optional[str]=None):
+        """
+        Returns the slow callbacks recorded by the monitor.
+        """
+        monitor = ServerObjects.lag_monitor
+        self.write({
+            "running": monitor is not None and monitor.running,
+            "records": list(monitor.records) if monitor is not None else [],
+        })
+
+    async def post(self, action:Optional[str]=None):
+        """
+        /admin/lag/start?threshold=0.1&interval=0.05 starts the monitor,
+        /admin/lag/stop stops it.
+        """
+        if action == "start":
+            interval = self._get_float_argument("interval", 0.05, minimum=MIN_INTERVAL)
+            threshold = self._get_float_argument("threshold", 0.1, minimum=MIN_INTERVAL)
+
+            if ServerObjects.lag_monitor is not None:
+                ServerObjects.lag_monitor.stop()
+
+            ServerObjects.lag_monitor = LoopLagMonitor(interval=interval, threshold=threshold)
+            ServerObjects.lag_monitor.start()
+        elif action == "stop":
+            if ServerObjects.lag_monitor is not None:
+                ServerObjects.lag_monitor.stop()
+        else:
+            raise tornado.web.HTTPError(404)
+
+        await self.get()
+
+
+def make_app(admin:bool=False) -> tornado.web.Application:
+    """
+    Creates the server application. The admin api, for profiling
+    and request timings, is only available when admin is True.
+    """
+    handlers: list = [
         (r"/datastore[/]*(.*)", DatastoreHandler),
+        (r"/presets/?(?:(\d+)/(\w+))?", PresetHandler),
         ("/apiversion", ApiVersionHandler)
-    ])
+    ]
 
+    if admin:
+        handlers += [
+            ("/admin/profile", ProfileHandler),
+            (r"/admin/lag/?(\w*)", LagMonitorHandler),
+        ]
 
-async def run_tornado_server(datastore:Optional[str]=None, port:int=8888) -> None:
-    setupDatastore(path=datastore)
-    app = make_app()
+    return tornado.web.Application(handlers, admin=admin)
+
+
+async def run_tornado_server(
+        datastore:Optional[str]=None, port:int=8888,
+        capture:Optional[str]=None, admin:bool=False,
+        presets:Optional[str]=None
+    ) -> None:
+    setupDatastore(path=datastore, presets=presets)
+    app = make_app(admin=admin)
     app.listen(port)
     logger.info(f"Server listening at http://localhost:{port}")
     logger.info(f"Datastore located at http://localhost:{port}/datastore")
+
+    if admin:
+        logger.info(f"Admin api located at http://localhost:{port}/admin")
+
+    if capture:
+        ServerObjects.capture = TrafficCapture(capture)
+        # Write out buffered records regularly so quiet periods are still captured.
+        tornado.ioloop.PeriodicCallback(ServerObjects.capture.flush, 1000).start()
+
     await asyncio.Event().wait()
 
 
 async def main(
         register_server:Optional[bool]=True,
         discovery_name:Optional[str]="Motu Test Server",
-        datastore:Optional[str]=None, port:int=8888
+        datastore:Optional[str]=None, port:int=8888,
+        capture:Optional[str]=None, admin:bool=False,
+        presets:Optional[str]=None
     ) -> None:
-    tornado_task = asyncio.create_task(run_tornado_server(datastore, port))
+    setupLogging()
+    tornado_task = asyncio.create_task(run_tornado_server(datastore, port, capture, admin, presets))
     zcr = MotuZeroConfRegistration(register_server, discovery_name, port)
     register_task = asyncio.create_task(zcr.register())
     try:
@@ -188,6 +496,11 @@ async def main(
     except asyncio.CancelledError:
         logger.info("Main tasks cancelled. Cleaning up...")
     finally:
+        if ServerObjects.capture is not None:
+            ServerObjects.capture.close()
+            ServerObjects.capture = None
+        if ServerObjects.lag_monitor is not None:
+            ServerObjects.lag_monitor.stop()
         await zcr.unregister()
 
 
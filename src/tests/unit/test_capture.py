@@ -0,0 +1,165 @@
+"""
+Tests for the capture and replay modules
+"""
+import os
+import tempfile
+import unittest
+import unittest.mock
+from motu_server.capture import CaptureRecord, TrafficCapture, read_capture
+from motu_server.server import ServerObjects
+from motu_server.replay import ReplayDriver, compare_reports, make_report, replay_against_app
+
+
+class CaptureRecordTests(unittest.TestCase):
+    def test_round_trip(self):
+        record = CaptureRecord(1.5, "PATCH", "mix/chan/0/matrix/aux/0/send", 1, None, "3", 200, 0.002, '{"value": "0.4"}')
+        res = CaptureRecord.from_line(record.to_line())
+
+        self.assertEqual(res.offset, 1.5)
+        self.assertEqual(res.method, "PATCH")
+        self.assertEqual(res.path, "mix/chan/0/matrix/aux/0/send")
+        self.assertEqual(res.client, 1)
+        self.assertIsNone(res.request_etag)
+        self.assertEqual(res.response_etag, "3")
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.duration, 0.002)
+        self.assertEqual(res.body, '{"value": "0.4"}')
+
+
+class TrafficCaptureTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        fd, self.path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+        super().tearDown()
+
+    def test_buffers_until_flush(self):
+        capture = TrafficCapture(self.path, buffer_size=10)
+        capture.record("GET", "mix/chan/0", 1, None, "0", 200, 0.001)
+        self.assertEqual(list(read_capture(self.path)), [])
+
+        capture.close()
+        records = list(read_capture(self.path))
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].path, "mix/chan/0")
+
+    def test_flushes_when_buffer_full(self):
+        capture = TrafficCapture(self.path, buffer_size=2)
+        capture.record("GET", "mix/chan/0", 1, None, "0", 200, 0.001)
+        capture.record("GET", "mix/chan/1", 1, None, "0", 200, 0.001)
+        self.assertEqual(len(list(read_capture(self.path))), 2)
+        capture.close()
+
+    def test_record_after_close_is_ignored(self):
+        capture = TrafficCapture(self.path)
+        capture.close()
+        capture.record("GET", "mix/chan/0", 1, None, "0", 200, 0.001)
+        capture.close()
+        self.assertEqual(list(read_capture(self.path)), [])
+
+
+class ReportTests(unittest.TestCase):
+    def test_make_report(self):
+        report = make_report([("GET", 0.1, 0.0, 200), ("GET", 0.3, 0.5, 200), ("PATCH", 0.2, 0.0, 500)], 2.0)
+
+        self.assertEqual(report["errors"], 1)
+        self.assertEqual(report["all"]["count"], 3)
+        self.assertEqual(report["all"]["throughput"], 1.5)
+        self.assertEqual(report["all"]["max"], 0.3)
+        self.assertEqual(report["categories"]["GET"]["p50"], 0.1)
+        self.assertEqual(report["categories"]["PATCH"]["count"], 1)
+        self.assertEqual(report["queue"]["max"], 0.5)
+
+    def test_compare_reports(self):
+        baseline = make_report([("GET", 0.2, 0.0, 200)], 1.0)
+        report = make_report([("GET", 0.1, 0.0, 200)], 1.0)
+        res = compare_reports(report, baseline)
+
+        self.assertAlmostEqual(res["categories"]["GET"]["mean"], -50.0)
+        self.assertEqual(res["categories"]["GET"]["count"], 0.0)
+
+
+class ReplayTests(unittest.IsolatedAsyncioTestCase):
+    async def test_replay_against_app(self):
+        records = [
+            CaptureRecord(0.0, "GET", "mix", 1),
+            CaptureRecord(0.01, "PATCH", "mix/chan/0/matrix/aux/0/send", 1, body='{"value": "0.4"}'),
+            CaptureRecord(0.02, "GET", "mix/chan/0/matrix/aux/0/send", 1),
+        ]
+        report = await replay_against_app(records, speed=10.0, clients=3)
+
+        self.assertEqual(report["errors"], 0)
+        self.assertEqual(report["all"]["count"], 9)
+        self.assertEqual(report["categories"]["PATCH"]["count"], 3)
+
+    async def test_replay_queues_beyond_max_connections(self):
+        # Long polls that nothing wakes hold the only connection, so
+        # the last request is queued until they time out.
+        records = [
+            CaptureRecord(0.0, "GET", "mix", 1, request_etag="0"),
+            CaptureRecord(0.0, "GET", "mix", 1),
+        ]
+        with unittest.mock.patch("motu_server.replay.REQUEST_TIMEOUT", 0.5):
+            report = await replay_against_app(records, max_connections=1)
+
+        self.assertEqual(report["all"]["count"], 2)
+        self.assertGreaterEqual(report["queue"]["max"], 0.2)
+        self.assertLess(report["categories"]["GET"]["max"], 0.2)
+
+    async def test_replay_polls_with_last_received_etag(self):
+        # The captured etag doesn't match the replay server, so the poll would
+        # return straight away if it were sent instead of the one received.
+        records = [
+            CaptureRecord(0.0, "GET", "mix", 1),
+            CaptureRecord(0.05, "GET", "mix", 1, request_etag="5"),
+            CaptureRecord(0.3, "PATCH", "mix/chan/0/matrix/aux/0/send", 2, body='{"value": "0.4"}'),
+        ]
+        report = await replay_against_app(records)
+
+        self.assertEqual(report["errors"], 0)
+        self.assertGreaterEqual(report["categories"]["POLL"]["max"], 0.2)
+
+    async def test_capture_records_handled_requests(self):
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        ServerObjects.capture = TrafficCapture(path)
+
+        try:
+            await replay_against_app([
+                CaptureRecord(0.0, "PATCH", "mix/chan/0/matrix/aux/0/send", 1, body='{"value": "0.4"}'),
+                CaptureRecord(0.01, "GET", "mix/chan/0", 2),
+            ], speed=10.0)
+            ServerObjects.capture.close()
+            records = sorted(read_capture(path), key=lambda r: r.offset)
+        finally:
+            ServerObjects.capture = None
+            os.remove(path)
+
+        self.assertEqual([r.method for r in records], ["PATCH", "GET"])
+        self.assertEqual(records[0].body, '{"value": "0.4"}')
+        self.assertEqual(records[0].response_etag, "1")
+        self.assertEqual(records[1].path, "mix/chan/0")
+        self.assertEqual(records[1].client, 2)
+
+    async def test_capture_keeps_non_numeric_client(self):
+        fd, path = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        ServerObjects.capture = TrafficCapture(path)
+
+        try:
+            await replay_against_app([CaptureRecord(0.0, "GET", "mix/chan/0", "abc")])
+            ServerObjects.capture.close()
+            records = list(read_capture(path))
+        finally:
+            ServerObjects.capture = None
+            os.remove(path)
+
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].client, "abc")
+
+    async def test_replay_empty_capture(self):
+        report = await ReplayDriver([], "http://127.0.0.1:1").run()
+        self.assertEqual(report["all"]["count"], 0)
@@ -116,6 +116,7 @@ class DatastoreTests(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(self.ds.parse_value("1"), 1)
         self.assertEqual(self.ds.parse_value("1.0"), 1.0)
         self.assertEqual(self.ds.parse_value("Channel1"), "Channel1")
+        self.assertEqual(self.ds.parse_value(0.5), 0.5)
 
     def test__expand_tree(self):
         inputs = {
@@ -231,4 +232,53 @@ class DatastoreTests(unittest.IsolatedAsyncioTestCase):
             "fader": 0.0,
             "pan": -1.0,
             "mute": 1
-        })
\ No newline at end of file
+        })
+
+    def test_read_paths(self):
+        self.assertEqual(self.ds.read(paths=[
+            "mix/chan/1/matrix/aux/0/send",
+            "mix/aux/0/matrix/fader",
+            "mix/missing/value",
+        ]), {
+            "mix/chan/1/matrix/aux/0/send": 1.0,
+            "mix/aux/0/matrix/fader": 1.0,
+        })
+
+        # glob patterns, relative to the given path
+        self.assertEqual(self.ds.read("mix", paths=["*/0/matrix/aux/0/send", "chan/0/matrix/aux/0/pan"]), {
+            "chan/0/matrix/aux/0/send": 1.0,
+            "chan/0/matrix/aux/0/pan": 0.0,
+            "group/0/matrix/aux/0/send": 1.0,
+            "reverb/0/matrix/aux/0/send": 1.0,
+        })
+
+        # subtrees
+        self.assertEqual(self.ds.read(paths=["mix/aux/0/matrix", "mix/aux/0/matrix/fader"]), {
+            "mix/aux/0/matrix/fader": 1.0,
+            "mix/aux/0/matrix/pan": 0.0,
+            "mix/aux/0/matrix/mute": 0.0,
+        })
+
+    async def test_read_last_update_paths(self):
+        await self.ds.write("mix/chan", {
+            "0/matrix/aux/0/send": 0.5,
+            "1/matrix/aux/0/pan": -1.0,
+        })
+        self.assertEqual(self.ds.read_last_update(paths=["mix/chan/*/matrix/aux/0/send"]), {
+            "mix/chan/0/matrix/aux/0/send": 0.5,
+        })
+
+    async def test_write_changes(self):
+        changes = await self.ds.write_changes({
+            "mix/aux/0/matrix/fader": 1.0,
+            "mix/aux/0/matrix/pan": 0.5,
+            "mix/aux/0/name": "01",
+        }, client_id=1)
+
+        self.assertEqual(changes, {"mix/aux/0/matrix/pan": 0.5, "mix/aux/0/name": "01"})
+        self.assertEqual(await self.ds.etag.value, 1)
+        self.assertEqual(self.ds.read("mix/aux/0/name"), {"value": "01"})
+        self.assertEqual(self.ds.read_last_update(), changes)
+
+        self.assertEqual(await self.ds.write_changes({"mix/aux/0/name": "01"}), {})
+        self.assertEqual(await self.ds.etag.value, 1)
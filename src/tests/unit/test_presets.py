@@ -0,0 +1,98 @@
+"""
+Tests for the presets module
+"""
+import os
+import tempfile
+import unittest
+from motu_server.datastore import Datastore
+from motu_server.presets import PresetStore
+
+
+class PresetStoreTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ds = Datastore({
+            "ext": {
+                "presets": {
+                    "device": "1001:Preset1:1002:Preset2"
+                }
+            },
+            "mix": {
+                "chan": {
+                    "0": {"name": "01", "matrix": {"fader": 1.0, "pan": 0.0}},
+                    "1": {"matrix": {"fader": 1.0, "pan": 0.0}},
+                }
+            }
+        })
+        self.presets = PresetStore(self.ds)
+
+    def test_loads_device_presets(self):
+        self.assertEqual(self.presets.list(), {1001: "Preset1", 1002: "Preset2"})
+
+    async def test_save_and_recall(self):
+        await self.presets.save(1001, client_id=1)
+        self.assertEqual(len(self.presets.presets[1001].values), 5)
+
+        await self.ds.write("mix/chan/0/matrix", {"fader": 0.25, "pan": -1.0})
+        await self.ds.write("mix/chan/1/matrix", {"fader": 0.5})
+        etag = await self.ds.etag.value
+
+        changes = await self.presets.recall(1001, client_id=2)
+
+        self.assertEqual(changes, {
+            "mix/chan/0/matrix/fader": 1.0,
+            "mix/chan/0/matrix/pan": 0.0,
+            "mix/chan/1/matrix/fader": 1.0,
+        })
+        self.assertEqual(await self.ds.etag.value, etag + 1)
+        self.assertEqual(await self.ds.etag.updated_by, 2)
+        self.assertEqual(self.ds.read("mix/chan/0/matrix"), {"fader": 1.0, "pan": 0.0})
+        self.assertEqual(self.ds.read_last_update(), changes)
+
+    async def test_recall_unchanged_does_not_write(self):
+        await self.presets.save(1001)
+        etag = await self.ds.etag.value
+
+        self.assertEqual(await self.presets.recall(1001), {})
+        self.assertEqual(await self.ds.etag.value, etag)
+
+    async def test_save_new_preset_updates_device_list(self):
+        await self.presets.save(1003, "Scene")
+        self.assertEqual(self.ds.read("ext/presets/device"), {"value": "1001:Preset1:1002:Preset2:1003:Scene"})
+
+    async def test_save_rejects_name_with_colon(self):
+        with self.assertRaises(ValueError):
+            await self.presets.save(1003, "a:b")
+
+        self.assertNotIn(1003, self.presets.presets)
+        self.assertEqual(self.ds.read("ext/presets/device"), {"value": "1001:Preset1:1002:Preset2"})
+
+    async def test_recall_errors(self):
+        with self.assertRaises(KeyError):
+            await self.presets.recall(9999)
+
+        with self.assertRaises(ValueError):
+            await self.presets.recall(1002)
+
+    async def test_recall_keeps_value_types(self):
+        await self.presets.save(1001)
+        await self.ds.write("mix/chan/0", {"name": "Vocals"})
+
+        self.assertEqual(await self.presets.recall(1001), {"mix/chan/0/name": "01"})
+        self.assertEqual(self.ds.read("mix/chan/0/name"), {"value": "01"})
+
+    async def test_presets_file(self):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        os.remove(path)
+
+        try:
+            await PresetStore(self.ds, path).save(1001)
+            await self.ds.write("mix/chan/0/matrix", {"fader": 0.25})
+
+            # A new store, as after a restart, can recall the saved preset.
+            changes = await PresetStore(self.ds, path).recall(1001)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(changes, {"mix/chan/0/matrix/fader": 1.0})
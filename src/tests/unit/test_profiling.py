@@ -0,0 +1,63 @@
+"""
+Tests for the profiling module
+"""
+import asyncio
+import time
+import unittest
+from motu_server.profiling import (
+    LoopLagMonitor, ProfilerBusyError, RequestTimer, format_collapsed, profile_pstats, sample_stacks
+)
+
+
+class RequestTimerTests(unittest.TestCase):
+    def test_laps(self):
+        timer = RequestTimer()
+        timer.lap("lock")
+        timer.lap("read")
+        timer.lap("lock")
+
+        self.assertEqual(list(timer.phases), ["lock", "read"])
+        header = timer.server_timing()
+        self.assertTrue(header.startswith("lock;dur="))
+        self.assertIn(", read;dur=", header)
+        self.assertIn(", total;dur=", header)
+
+
+class ProfileTests(unittest.IsolatedAsyncioTestCase):
+    async def test_sample_stacks(self):
+        counts = await sample_stacks(0.05, interval=0.001)
+
+        self.assertTrue(counts)
+        self.assertTrue(all(";" in stack for stack in counts))
+        self.assertEqual(format_collapsed({"a;b": 1, "a;c": 3}), "a;c 3\na;b 1\n")
+
+    async def test_one_profile_at_a_time(self):
+        running = asyncio.create_task(sample_stacks(0.05))
+        await asyncio.sleep(0)
+
+        with self.assertRaises(ProfilerBusyError):
+            await profile_pstats(0.01)
+
+        await running
+        self.assertIn("function calls", await profile_pstats(0.01))
+
+
+class LoopLagMonitorTests(unittest.IsolatedAsyncioTestCase):
+    async def test_records_blocking_callbacks(self):
+        monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+        monitor.start()
+
+        try:
+            await asyncio.sleep(0.02)
+            time.sleep(0.15)
+            await asyncio.sleep(0.05)
+        finally:
+            monitor.stop()
+
+        self.assertFalse(monitor.running)
+        self.assertGreaterEqual(len(monitor.records), 1)
+
+        # Other records may be kept if the machine is busy, so find the blocking one by its stack.
+        blocking = [r for r in monitor.records if r["stack"] and "test_records_blocking_callbacks" in r["stack"]]
+        self.assertTrue(blocking)
+        self.assertGreaterEqual(blocking[0]["lag"], 0.05)
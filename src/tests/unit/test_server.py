@@ -0,0 +1,160 @@
+"""
+Tests for the server request handlers
+"""
+import asyncio
+import json
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from motu_server.datastore import Datastore
+from motu_server.presets import PresetStore
+from motu_server.server import ServerObjects, make_app
+
+
+class DatastoreHandlerTests(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        ServerObjects.datastore = Datastore({
+            "mix": {
+                "chan": {
+                    "0": {"matrix": {"aux": {"0": {"send": 1.0}}}, "gate": {"enable": 0}},
+                    "1": {"matrix": {"aux": {"0": {"send": 0.5}}}, "gate": {"enable": 1}},
+                }
+            },
+            "ext": {"obank": {"2": {"ch": {"0": {"name": "Out 1"}}}}},
+        })
+        ServerObjects.clients = {}
+        ServerObjects.presets = PresetStore(ServerObjects.datastore)
+
+    def get_app(self):
+        return make_app()
+
+    def test_get_paths(self):
+        response = self.fetch(
+            "/datastore?paths=mix/chan/*/matrix/aux/0/send,ext/obank/2/ch/0/name&paths=mix/chan/1/gate/enable"
+        )
+
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Etag"], "0")
+        self.assertEqual(json.loads(response.body), {
+            "mix/chan/0/matrix/aux/0/send": 1.0,
+            "mix/chan/1/matrix/aux/0/send": 0.5,
+            "ext/obank/2/ch/0/name": "Out 1",
+            "mix/chan/1/gate/enable": 1,
+        })
+
+    def test_get_empty_paths_reads_everything(self):
+        response = self.fetch("/datastore/mix/chan/0?paths=")
+        self.assertEqual(json.loads(response.body), {"matrix/aux/0/send": 1.0, "gate/enable": 0})
+
+    def test_patch_keeps_floats(self):
+        response = self.fetch(
+            "/datastore/mix/chan/0/matrix/aux/0/send?client=1&json=%7B%22value%22%3A0.5%7D",
+            method="PATCH", body=""
+        )
+        self.assertEqual(response.code, 200)
+        self.assertEqual(ServerObjects.datastore.read("mix/chan/0/matrix/aux/0/send"), {"value": 0.5})
+
+    @gen_test
+    async def test_long_poll_filtered_by_paths(self):
+        poll = self.http_client.fetch(
+            self.get_url("/datastore?client=1&paths=mix/chan/*/gate/enable"),
+            headers={"If-None-Match": "0"}
+        )
+
+        # The first two updates don't match the paths so the poll keeps waiting.
+        for base_path, values in [
+            ("mix/chan/0/matrix/aux/0", {"send": "0.2"}),
+            ("ext/obank/2/ch/0", {"name": "Main"}),
+            ("mix/chan/1/gate", {"enable": "0"}),
+        ]:
+            await asyncio.sleep(0.05)
+            self.assertFalse(poll.done())
+            await ServerObjects.datastore.write(base_path, values, client_id=2)
+
+        response = await poll
+        self.assertEqual(response.headers["Etag"], "3")
+        self.assertEqual(json.loads(response.body), {"mix/chan/1/gate/enable": 0})
+
+
+class PresetHandlerTests(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        ServerObjects.datastore = Datastore({
+            "ext": {"presets": {"device": "1001:Preset1:1002:Preset2"}},
+            "mix": {"chan": {"0": {"matrix": {"fader": 1.0}}}},
+        })
+        ServerObjects.clients = {}
+        ServerObjects.presets = PresetStore(ServerObjects.datastore)
+
+    def get_app(self):
+        return make_app()
+
+    def _post(self, url: str):
+        return self.fetch(url, method="POST", body="")
+
+    def test_list(self):
+        response = self.fetch("/presets")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {"1001": "Preset1", "1002": "Preset2"})
+
+    def test_save_and_recall(self):
+        response = self._post("/presets/1003/save?client=1&name=Scene")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {"id": 1003, "name": "Scene", "count": 1})
+        self.assertEqual(response.headers["Etag"], "1")
+
+        self.fetch("/datastore/mix/chan/0/matrix/fader?client=1&json=%7B%22value%22%3A0.5%7D", method="PATCH", body="")
+
+        response = self._post("/presets/1003/recall?client=1")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(json.loads(response.body), {"id": 1003, "changed": 1})
+        self.assertEqual(response.headers["Etag"], "3")
+        self.assertEqual(ServerObjects.datastore.read("mix/chan/0/matrix/fader"), {"value": 1.0})
+
+    def test_recall_errors(self):
+        self.assertEqual(self._post("/presets/9999/recall").code, 404)
+        self.assertEqual(self._post("/presets/1002/recall").code, 409)
+
+    def test_bad_requests(self):
+        self.assertEqual(self._post("/presets/1001/delete").code, 404)
+        self.assertEqual(self._post("/presets").code, 404)
+        self.assertEqual(self.fetch("/presets/1001/save").code, 404)
+        self.assertEqual(self._post("/presets/1003/save?name=a%3Ab").code, 400)
+        self.assertEqual(ServerObjects.presets.list(), {1001: "Preset1", 1002: "Preset2"})
+
+
+class AdminTests(AsyncHTTPTestCase):
+    def setUp(self):
+        super().setUp()
+        ServerObjects.datastore = Datastore({"mix": {"chan": {"0": {"matrix": {"aux": {"0": {"send": 1.0}}}}}}})
+        ServerObjects.clients = {}
+
+    def get_app(self):
+        return make_app(admin=True)
+
+    def _phases(self, response) -> list[str]:
+        return [timing.split(";")[0] for timing in response.headers["Server-Timing"].split(", ")]
+
+    def test_get_server_timing(self):
+        response = self.fetch("/datastore/mix", headers={"X-Debug-Timing": "1"})
+        self.assertEqual(self._phases(response), ["parse", "lock", "log", "read", "encode", "total"])
+
+    def test_patch_server_timing(self):
+        response = self.fetch(
+            "/datastore/mix/chan/0/matrix/aux/0/send?client=1&json=%7B%22value%22%3A0.5%7D",
+            method="PATCH", body="", headers={"X-Debug-Timing": "1"}
+        )
+        self.assertEqual(self._phases(response), ["log", "parse", "lock", "apply", "notify", "total"])
+
+    def test_no_server_timing_without_header(self):
+        response = self.fetch("/datastore/mix")
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_profile_bad_arguments(self):
+        self.assertEqual(self.fetch("/admin/profile?seconds=abc").code, 400)
+        self.assertEqual(self.fetch("/admin/profile?seconds=0.1&interval=0").code, 400)
+        self.assertEqual(self.fetch("/admin/profile?seconds=0.1&format=other").code, 400)
+        self.assertEqual(self.fetch("/admin/lag/start?threshold=abc", method="POST", body="").code, 400)
+
+    def test_profile(self):
+        response = self.fetch("/admin/profile?seconds=0.05&interval=0.001")
+        self.assertEqual(response.code, 200)